@@ -30,7 +30,7 @@ if exist "%PY%" (
   set "PY=python"
 )
 
-"%PY%" "%SCRIPT%" --data "%DATA_FILE%" --dedug-first-start-thread --explain-thread "GameThread" --equalize-root-sum
+"%PY%" "%SCRIPT%" --data "%DATA_FILE%" --html --svg --dedug-first-start-thread --explain-thread "GameThread" --equalize-root-sum
 set "RC=%ERRORLEVEL%"
 if %RC% NEQ 0 (
   echo Failed with exit code %RC%.
@@ -8,6 +8,8 @@ Collapse simpleperf report into folded stacks / HTML tree / FlameGraph.
 """
 
 import argparse
+import atexit
+import codecs
 import os
 import re
 import subprocess
@@ -18,26 +20,130 @@ import stat
 import shutil
 import json
 
-from collections import defaultdict
+from array import array
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+
+# Optional faster JSON encoders for the HTML data blob; stdlib json is the fallback
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Precompiled patterns used by the per-line parsing loops
+_PCT_RE = re.compile(r'^(\d+\.\d+)%')
+_SPLIT_RE = re.compile(r'\s{2,}')
+_PIPE_FRAME_RE = re.compile(r'\|--(\d+\.\d+)%--\s*(.+)')
+_HAS_PCT_RE = re.compile(r'\d+\.\d+%')
+
+# Report header field name (text before the first ':') -> basic_info key
+_HEADER_KEYS = {
+    'Cmdline': 'cmdline',
+    'Arch': 'arch',
+    'Event': 'event',
+    'Samples': 'samples',
+    'Error Callchains': 'error_callchains',
+    'Event count': 'event_count',
+}
+_HEADER_PREFIXES = tuple(f"{name}:" for name in _HEADER_KEYS)
+
+# Buffer size for the folded / HTML output files (fewer, larger writes than the 8KB default)
+_WRITE_BUFFER = 1 << 20
+
 
+def _split_columns(row):
+    """Split a report table row on runs of two or more whitespace characters."""
+    if '\t' in row:
+        return _SPLIT_RE.split(row)
+    # str.split on the two-space separator is much cheaper than the regex; odd-length runs
+    # leave one space on the next field and longer runs leave empty fields, both dropped here.
+    return [field for field in map(str.strip, row.split('  ')) if field]
 
-def read_text_file_auto(path):
+
+def iter_report_lines(path):
+    """Yield the lines of a text report without line terminators, detecting UTF-8/UTF-16 from the first bytes."""
     with open(path, 'rb') as f:
-        data = f.read()
-    try:
-        return data.decode('utf-8-sig')
-    except Exception:
-        pass
-    try:
-        return data.decode('utf-16')
-    except Exception:
-        pass
-    for enc in ('utf-16-le', 'utf-16-be', 'utf-8', 'latin-1'):
-        try:
-            return data.decode(enc)
-        except Exception:
-            continue
-    return data.decode('utf-8', errors='replace')
+        head = f.read(4)
+    if head.startswith(codecs.BOM_UTF8):
+        encoding = 'utf-8-sig'
+    elif head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        encoding = 'utf-16'
+    elif head[1:2] == b'\x00':
+        # UTF-16 without BOM, e.g. ASCII text redirected by PowerShell
+        encoding = 'utf-16-le'
+    elif head[:1] == b'\x00':
+        encoding = 'utf-16-be'
+    else:
+        encoding = 'utf-8'
+    with open(path, 'r', encoding=encoding, errors='replace') as f:
+        for line in f:
+            yield line.rstrip('\n')
+
+
+class _LineReader:
+    """Forward-only line source with pushback and lookahead, so the parsers can stream the report."""
+
+    def __init__(self, lines):
+        self._it = iter(lines)
+        self._pending = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._pending:
+            return self._pending.popleft()
+        return next(self._it)
+
+    def push_back(self, line):
+        self._pending.appendleft(line)
+
+    def stream(self):
+        """Iterate lines without a Python-level __next__ call per line.
+
+        For leaf loops only: the loop may push back one line just before it stops, but must
+        not hand the reader to code that reads from it while iterating.
+        """
+        if not self._pending:
+            # The underlying iterator itself; pushed-back lines go to _pending, so nothing is lost
+            return self._it
+        return self._drain_pending()
+
+    def _drain_pending(self):
+        pending = self._pending
+        while pending:
+            yield pending.popleft()
+        # Plain loop rather than 'yield from': closing this generator must not close self._it
+        for line in self._it:
+            yield line
+
+    def peek(self, count):
+        """Return up to `count` upcoming lines without consuming them."""
+        while len(self._pending) < count:
+            line = next(self._it, None)
+            if line is None:
+                break
+            self._pending.append(line)
+        return list(islice(self._pending, count))
+
+    def lookahead_any(self, pred):
+        """Buffer upcoming lines until one satisfies `pred`; return whether such a line exists.
+
+        Without a match this buffers the rest of the input; parse_report_text callers that can
+        re-read the report pass has_tree from report_has_tree() instead.
+        """
+        if any(pred(line) for line in self._pending):
+            return True
+        for line in self._it:
+            self._pending.append(line)
+            if pred(line):
+                return True
+        return False
 
 
 def run_simpleperf_report(data_path):
@@ -53,54 +159,81 @@ def run_simpleperf_report(data_path):
     try:
         p0 = subprocess.run(cmd_with_simple, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, text=True)
         p = subprocess.run(cmd_with_sg, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, text=True)
-        # Read back the generated report file (stdout may be empty when using -o)
-        try:
-            with open(report_sg_txt, 'r', encoding='utf-8') as f:
-                return f.read()
-        except Exception:
-            # Fallback to stdout if reading file fails for any reason
-            return p.stdout
+        # The report is parsed by streaming it back from disk, so hand out the file path
+        if os.path.isfile(report_sg_txt):
+            return report_sg_txt
+        output = p.stdout
     except Exception:
         # Fallback: run without -o, capture stdout, and write it to report_sg_txt
         cmd = ["simpleperf", "report", "-i", data_path, "-g"]
         try:
             p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, text=True)
-            try:
-                with open(report_sg_txt, 'w', encoding='utf-8') as f:
-                    f.write(p.stdout)
-            except Exception:
-                pass
-            return p.stdout
         except Exception:
             return None
+        output = p.stdout
+    try:
+        with open(report_sg_txt, 'w', encoding='utf-8') as f:
+            f.write(output)
+        return report_sg_txt
+    except Exception:
+        # Data directory not writable: keep the report in a temp file instead, removed at exit
+        # (including sys.exit) once the parse and explain passes no longer need it
+        fd, tmp_path = tempfile.mkstemp(prefix=f"report_{base_name}_sg_", suffix='.txt')
+        atexit.register(_remove_file, tmp_path)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(output)
+        return tmp_path
+
+
+def _remove_file(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def _is_tree_line(line):
+    return line.strip().startswith('-- ') or ('|--' in line)
 
 
-def parse_report_text(text, reverse=False, dedug_first_start=False, equalize_root_sum=False):
-    lines = text.splitlines()
-    stacks = {}
+def report_has_tree(lines):
+    """Return whether report lines contain any callgraph tree line (tree mode vs brief mode)."""
+    return any(_is_tree_line(line) for line in lines)
+
+
+def parse_report_text(lines, reverse=False, dedug_first_start=False, equalize_root_sum=False, on_stack=None, jobs=1,
+                      has_tree=None):
+    """Parse report lines (any iterable of str, consumed once) into folded stacks.
+
+    If on_stack is given, every (stack, count) produced by a table entry is passed to it instead
+    of being accumulated here, and the returned stack dicts are empty. With jobs > 1, the
+    callgraph trees of table entries are parsed in that many worker processes. has_tree, when
+    known from a separate report_has_tree() pass, saves buffering a brief-mode report whole.
+    """
+    if isinstance(lines, str):
+        raise TypeError('parse_report_text() takes report lines, not the report text; use iter_report_lines()')
+    reader = _LineReader(lines)
+    stacks = defaultdict(float)
+    if on_stack is None:
+        def on_stack(key, count):
+            stacks[key] += count
 
     # Basic info
     basic_info = {}
     event_count = None
     total_samples = None
-    for line in lines[:40]:
-        s = line.strip()
-        if s.startswith('Cmdline:'):
-            basic_info['cmdline'] = s.replace('Cmdline:', '').strip()
-        elif s.startswith('Arch:'):
-            basic_info['arch'] = s.replace('Arch:', '').strip()
-        elif s.startswith('Event:'):
-            basic_info['event'] = s.replace('Event:', '').strip()
-        elif s.startswith('Samples:'):
-            basic_info['samples'] = s.replace('Samples:', '').strip()
+    for line in reader.peek(40):
+        name, sep, value = line.strip().partition(':')
+        field = _HEADER_KEYS.get(name) if sep else None
+        if field is None:
+            continue
+        basic_info[field] = value.strip()
+        if field == 'samples':
             try:
                 total_samples = int(basic_info['samples'])
             except Exception:
                 pass
-        elif s.startswith('Error Callchains:'):
-            basic_info['error_callchains'] = s.replace('Error Callchains:', '').strip()
-        elif s.startswith('Event count:'):
-            basic_info['event_count'] = s.replace('Event count:', '').strip()
+        elif field == 'event_count':
             try:
                 event_count = int(basic_info['event_count'])
             except Exception:
@@ -112,11 +245,21 @@ def parse_report_text(text, reverse=False, dedug_first_start=False, equalize_roo
     events_per_sample = event_count / total_samples if total_samples > 0 else 1
     event_total = events_per_sample * total_samples
 
-    has_tree = any(l.strip().startswith('-- ') or ('|--' in l) for l in lines)
-    is_brief = (not has_tree) and any('skipped in brief callgraph mode' in l for l in lines)
+    if has_tree is None:
+        has_tree = reader.lookahead_any(_is_tree_line)
+
+    # Tree mode with jobs > 1: entries are handed to worker processes as line lists and their
+    # results merged back in submission order, so stacks come out in the same order as serially.
+    pool = ProcessPoolExecutor(max_workers=jobs) if (has_tree and jobs > 1) else None
+    in_flight = deque()
+
+    def collect_entries(limit):
+        while len(in_flight) > limit:
+            for stack, count in in_flight.popleft().result():
+                on_stack(stack, count)
 
     # Brief mode: aggregate contiguous rows by thread, use the first row's Children% for the whole block
-    current = None  # {'thread_key': (command,pid,tid), 'command': str, 'symbols': [...], 'block_pct': float}
+    current = None  # {'thread_key': (command,pid,tid), 'command': str, 'symbols': [...], 'block_pct': float, 'starts_thread': bool}
     emitted_threads = set()  # threads already emitted when dedug_first_start is enabled
 
     def flush_current_block():
@@ -128,12 +271,8 @@ def parse_report_text(text, reverse=False, dedug_first_start=False, equalize_roo
             return
         should_emit = True
         if dedug_first_start:
-            if current['thread_key'] in emitted_threads:
+            if current['thread_key'] in emitted_threads or not current['starts_thread']:
                 should_emit = False
-            else:
-                first_sym = current['symbols'][0] if current['symbols'] else ''
-                if '__start_thread' not in first_sym:
-                    should_emit = False
         if should_emit:
             elems = [current['command']] + current['symbols']
             if reverse:
@@ -141,123 +280,147 @@ def parse_report_text(text, reverse=False, dedug_first_start=False, equalize_roo
             key = ';'.join(elems)
             cnt_float = event_total * (current['block_pct'] / 100.0)
             if cnt_float > 0.0:
-                stacks[key] = stacks.get(key, 0.0) + cnt_float
+                on_stack(key, cnt_float)
             if dedug_first_start:
                 emitted_threads.add(current['thread_key'])
 
-    i = 0
-    while i < len(lines):
-        line = lines[i].rstrip()
-        if not line:
-            i += 1
-            continue
-        if line.startswith('Cmdline:') or line.startswith('Arch:') or line.startswith('Event:') \
-           or line.startswith('Samples:') or line.startswith('Error Callchains:') or line.startswith('Event count:'):
-            i += 1
-            continue
-        if 'Children' in line and 'Self' in line and 'Command' in line:
-            i += 1
-            continue
-        if 'skipped in brief callgraph mode' in line:
-            # Mark current brief block as skipped to avoid double counting
-            if not has_tree and current is not None:
-                current['skip'] = True
-            i += 1
-            continue
-
-        if re.match(r'^\d+\.\d+%', line):
-            parts = re.split(r'\s{2,}', line)
-            if len(parts) < 6:
-                i += 1
+    try:
+        for line in reader:
+            line = line.rstrip()
+            if not line:
                 continue
-            command = parts[2].strip()
-            pid = parts[3].strip() if len(parts) > 3 else ''
-            tid = parts[4].strip() if len(parts) > 4 else ''
-            symbol = parts[-1].strip()
-            try:
-                children_pct_val = float(parts[0].strip().rstrip('%'))
-            except Exception:
-                children_pct_val = 100.0
-
-            if has_tree:
-                # Tree mode: only keep first main entry per thread starting from __start_thread if dedug_first_start
-                key_thread = (command, pid, tid)
-                if dedug_first_start:
-                    if key_thread in emitted_threads:
-                        i = skip_to_next_main_entry(lines, i + 1)
-                        continue
-                    if '__start_thread' not in symbol:
-                        i = skip_to_next_main_entry(lines, i + 1)
-                        continue
-                i += 1
-                tree_stacks = parse_entry_callstack(lines, i, command, children_pct_val, events_per_sample, total_samples, equalize_root_sum)
-                for stack_str, count in tree_stacks.items():
-                    stk = ';'.join(reversed(stack_str.split(';'))) if reverse else stack_str
-                    # Skip zero-count stacks
-                    if float(count) <= 0.0:
-                        continue
-                    stacks[stk] = stacks.get(stk, 0.0) + float(count)
-                if dedug_first_start:
-                    emitted_threads.add(key_thread)
-                i = skip_to_next_main_entry(lines, i)
+            if line.startswith(_HEADER_PREFIXES):
                 continue
-            else:
-                # Brief mode
-                key_thread = (command, pid, tid)
-                if current is None:
-                    current = {
-                        'thread_key': key_thread,
-                        'command': command,
-                        'symbols': [symbol] if symbol else [],
-                        'block_pct': children_pct_val,
-                        'skip': False,
-                    }
-                else:
-                    if key_thread == current['thread_key']:
-                        if symbol and (not current['symbols'] or current['symbols'][-1] != symbol):
-                            current['symbols'].append(symbol)
+            if 'Children' in line and 'Self' in line and 'Command' in line:
+                continue
+            if 'skipped in brief callgraph mode' in line:
+                # Mark current brief block as skipped to avoid double counting
+                if not has_tree and current is not None:
+                    current['skip'] = True
+                continue
+
+            m = _PCT_RE.match(line) if line[:1].isdigit() else None
+            if m:
+                parts = _split_columns(line)
+                if len(parts) < 6:
+                    continue
+                command = sys.intern(parts[2].strip())
+                pid = parts[3].strip() if len(parts) > 3 else ''
+                tid = parts[4].strip() if len(parts) > 4 else ''
+                symbol = parts[-1].strip()
+                children_pct_val = float(m.group(1))
+                starts_thread = '__start_thread' in symbol
+
+                if has_tree:
+                    # Tree mode: only keep first main entry per thread starting from __start_thread if dedug_first_start
+                    key_thread = (command, pid, tid)
+                    if dedug_first_start and (not starts_thread or key_thread in emitted_threads):
+                        skip_to_next_main_entry(reader)
+                        continue
+                    entry_args = (command, children_pct_val, events_per_sample, total_samples, equalize_root_sum, reverse)
+                    if pool is not None:
+                        in_flight.append(pool.submit(_entry_stacks_from_lines, _read_entry_lines(reader), *entry_args))
+                        collect_entries(jobs * 4)
                     else:
-                        # flush previous contiguous block for the prior thread (with optional dedug/skip)
-                        flush_current_block()
-                        # start new block for new thread
+                        for stack, count in _entry_stacks(reader, *entry_args):
+                            on_stack(stack, count)
+                    if dedug_first_start:
+                        emitted_threads.add(key_thread)
+                    continue
+                else:
+                    # Brief mode
+                    key_thread = (command, pid, tid)
+                    if current is None:
                         current = {
                             'thread_key': key_thread,
                             'command': command,
                             'symbols': [symbol] if symbol else [],
                             'block_pct': children_pct_val,
+                            'starts_thread': starts_thread,
                             'skip': False,
                         }
-                i += 1
-                continue
-        else:
-            i += 1
+                    else:
+                        if key_thread == current['thread_key']:
+                            if symbol and (not current['symbols'] or current['symbols'][-1] != symbol):
+                                current['symbols'].append(symbol)
+                        else:
+                            # flush previous contiguous block for the prior thread (with optional dedug/skip)
+                            flush_current_block()
+                            # start new block for new thread
+                            current = {
+                                'thread_key': key_thread,
+                                'command': command,
+                                'symbols': [symbol] if symbol else [],
+                                'block_pct': children_pct_val,
+                                'starts_thread': starts_thread,
+                                'skip': False,
+                            }
+                    continue
+
+        if pool is not None:
+            collect_entries(0)
+    finally:
+        # Also on a worker failure re-raised by collect_entries, so no pool outlives the parse
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
 
     # finalize remaining active block (brief mode)
     if not has_tree and current is not None and current.get('symbols'):
         flush_current_block()
 
-    raw_stacks = dict(stacks)
+    # The unrounded accumulator is returned as-is as raw_stacks; no need for a second copy
     final_stacks = {k: int(round(v)) for k, v in stacks.items() if v > 0}
-    return final_stacks, event_count, total_samples, basic_info, raw_stacks
+    return final_stacks, event_count, total_samples, basic_info, stacks
+
 
+def _entry_stacks(reader, command, children_pct, events_per_sample, total_samples, equalize_root_sum, reverse):
+    """Parse one table entry's callgraph into (stack, count) pairs ready to accumulate."""
+    result = []
+    for stack_str, count in parse_entry_callstack(reader, command, children_pct, events_per_sample, total_samples, equalize_root_sum):
+        stk = ';'.join(reversed(stack_str.split(';'))) if reverse else stack_str
+        # Skip zero-count stacks
+        if float(count) <= 0.0:
+            continue
+        result.append((stk, float(count)))
+    return result
+
+
+def _entry_stacks_from_lines(entry_lines, *entry_args):
+    # Worker-process entry point for parse_report_text(jobs > 1)
+    return _entry_stacks(_LineReader(entry_lines), *entry_args)
 
-def find_thread_head_pct(report_text, thread_name):
+
+def _read_entry_lines(reader):
+    """Consume and return the lines of the current table entry, up to the next main row."""
+    entry_lines = []
+    for line in reader.stream():
+        if line[:1].isdigit() and _PCT_RE.match(line):
+            reader.push_back(line)
+            break
+        entry_lines.append(line)
+    return entry_lines
+
+
+def find_thread_head_pct(report_lines, thread_name):
     """Find the first Children% row for a given thread in the table (prefer __start_thread if present)."""
+    if isinstance(report_lines, str):
+        raise TypeError('find_thread_head_pct() takes report lines, not the report text; use iter_report_lines()')
     best_pct = None
     first_pct = None
-    for line in report_text.splitlines():
-        if not re.match(r'^\d+\.\d+%', line.strip()):
+    for line in report_lines:
+        # Only rows mentioning the thread can match; test that before any splitting
+        if thread_name not in line or '%' not in line:
+            continue
+        m = _PCT_RE.match(line.strip())
+        if not m:
             continue
-        parts = re.split(r'\s{2,}', line.rstrip())
+        parts = _split_columns(line.rstrip())
         if len(parts) < 6:
             continue
         command = parts[2].strip()
         if command != thread_name:
             continue
-        try:
-            pct = float(parts[0].strip().rstrip('%'))
-        except Exception:
-            continue
+        pct = float(m.group(1))
         symbol = parts[-1].strip()
         if first_pct is None:
             first_pct = pct
@@ -267,24 +430,20 @@ def find_thread_head_pct(report_text, thread_name):
     return best_pct if best_pct is not None else first_pct
 
 
-def parse_entry_callstack(lines, start_idx, command, children_pct, events_per_sample, total_samples, equalize_root_sum=False):
-    stacks = {}
-    i = start_idx
-
-    while i < len(lines):
-        line = lines[i]
+def parse_entry_callstack(reader, command, children_pct, events_per_sample, total_samples, equalize_root_sum=False):
+    """Yield (stack, count) for every callgraph tree of one table entry, tree by tree."""
+    for line in reader:
         if not line.strip():
-            i += 1
             continue
-        if re.match(r'^\d+\.\d+%', line):
+        if line[:1].isdigit() and _PCT_RE.match(line):
+            reader.push_back(line)
             break
         if line.strip() == '|' or 'skipped in brief callgraph mode' in line:
-            i += 1
             continue
         if line.strip().startswith('-- '):
             root_func = line.strip()[3:].strip()
             if root_func and len(root_func) > 1:
-                tree_stacks = parse_callstack_tree_new(lines, i, command, children_pct, events_per_sample, total_samples)
+                tree_stacks = parse_callstack_tree_new(reader, line, command, children_pct, events_per_sample, total_samples)
                 # Equalize: scale this root's stacks so their sum equals EventCount * Children%
                 if equalize_root_sum and '__start_thread' in root_func:
                     event_total = events_per_sample * total_samples
@@ -294,194 +453,147 @@ def parse_entry_callstack(lines, start_idx, command, children_pct, events_per_sa
                         factor = block_total / ssum
                         for k in list(tree_stacks.keys()):
                             tree_stacks[k] *= factor
-                for stack_str, count in tree_stacks.items():
-                    stacks[stack_str] = stacks.get(stack_str, 0.0) + count
-            i = skip_to_next_tree_or_main_entry(lines, i)
-            continue
-        i += 1
-
-    return stacks
+                # The tree parser stops at the next root or table row, so nothing is left to skip
+                yield from tree_stacks.items()
+            else:
+                skip_to_next_tree_or_main_entry(reader)
 
 
-def parse_callstack_tree_new(lines, start_idx, command, children_pct, events_per_sample, total_samples):
-    stacks = {}
+def parse_callstack_tree_new(reader, root_line, command, children_pct, events_per_sample, total_samples):
+    stacks = defaultdict(float)
 
-    root_line = lines[start_idx].strip()
+    root_line = root_line.strip()
     if not root_line.startswith('-- '):
         return stacks
     root_func = root_line[3:].strip()
 
     base_path = [command, root_func] if (command and command != 'Unknown') else [root_func]
+    base_key = ';'.join(base_path)
     event_total = events_per_sample * total_samples
 
-    frames = []
-    context_stack = []
-    pending_context = []
+    # Frame stack as parallel arrays: name, full folded key and fraction of the root's
+    # Children% (both extended from the parent's value on push, so emitting a leaf never
+    # re-walks the path), and whether the frame has a child.
+    base_frac = (children_pct / 100.0) if children_pct is not None else 1.0
+    frame_names = []
+    frame_keys = []
+    frame_fracs = array('d')
+    frame_has_child = bytearray()
+    # Occurrences of each name on the stack, for O(1) recursion checks. A count rather than a
+    # set because implicit frames may repeat a name already on the stack.
+    names_on_stack = defaultdict(int)
     emitted = set()
     pipe_base_depth = None  # 基准深度：首次遇到管道形式的节点时，固定为当前帧栈深度
 
-    def flatten_context(upto_level):
-        res = []
-        for idx in range(min(upto_level, len(context_stack))):
-            res.extend(context_stack[idx])
-        return res
-
-    def emit_leaf(frames_prefix):
-        if not frames_prefix:
+    def push_frame(name, pct):
+        if frame_names:
+            frame_has_child[-1] = 1
+            parent_key = frame_keys[-1]
+            parent_frac = frame_fracs[-1]
+        else:
+            parent_key = base_key
+            parent_frac = base_frac
+        names_on_stack[name] += 1
+        frame_names.append(name)
+        frame_keys.append(parent_key + ';' + name)
+        frame_fracs.append(parent_frac * (pct / 100.0))
+        frame_has_child.append(0)
+
+    def pop_frame():
+        if not frame_has_child[-1]:
+            emit_leaf()
+        name = frame_names.pop()
+        if names_on_stack[name] == 1:
+            del names_on_stack[name]
+        else:
+            names_on_stack[name] -= 1
+        frame_keys.pop()
+        frame_fracs.pop()
+        frame_has_child.pop()
+
+    def emit_leaf():
+        # Emit the path formed by all frames currently on the stack
+        if not frame_keys:
             return
-        frac = (children_pct / 100.0) if children_pct is not None else 1.0
-        for fr in frames_prefix:
-            pct = fr.get('pct')
-            if pct is not None:
-                frac *= (pct / 100.0)
-        count_float = event_total * frac
-        ctx = flatten_context(len(frames_prefix))
-        stack_path = base_path + ctx + [fr['name'] for fr in frames_prefix]
-        key = ';'.join(stack_path)
+        key = frame_keys[-1]
         if key in emitted:
             return
         emitted.add(key)
-        stacks[key] = stacks.get(key, 0.0) + count_float
-
-    i = start_idx + 1
-    while i < len(lines):
-        line = lines[i]
-        if not line.strip():
-            i += 1
+        stacks[key] += event_total * frame_fracs[-1]
+
+    # The line is stripped once and classified by its first visible character; the frame
+    # row regex below only runs on lines that can still be '|--NN.NN%-- func' rows.
+    truncated = False  # past the depth limit: the rest of this tree is read but ignored
+    for line in reader.stream():
+        stripped = line.strip()
+        if not stripped:
             continue
         # stop only on main-entry row or a new root at column 0
-        if re.match(r'^\d+\.\d+%', line) or line.startswith('-- '):
+        if (line[:1].isdigit() and _PCT_RE.match(line)) or line.startswith('-- '):
+            reader.push_back(line)
             break
-        if line.strip() == '|' or 'skipped in brief callgraph mode' in line:
-            i += 1
+        if truncated or stripped == '|' or 'skipped in brief callgraph mode' in line:
             continue
 
-        stripped_full = line.strip()
-        stripped_l = line.lstrip()
-
-        # implicit child frame without markers: treat as a child of previous level (100% weight)
-        if stripped_full and not stripped_full.startswith('|') and not stripped_full.startswith('--') and not re.search(r'\d+\.\d+%', stripped_full):
-            if frames:
-                frames[-1]['child'] = True
-            frames.append({'name': stripped_full, 'pct': None, 'child': False})
-            i += 1
-            continue
-
-        # child node without percentage like "   -- func" => treat as frame with 100%
-        if stripped_l.startswith('-- '):
-            func_name = stripped_l[3:].strip()
-            if pending_context:
-                depth = len(frames)
-                while len(context_stack) < depth:
-                    context_stack.append([])
-                if len(context_stack) == depth:
-                    context_stack.append(pending_context[:])
-                else:
-                    context_stack[depth].extend(pending_context)
-                pending_context.clear()
-            if any(fr['name'] == func_name for fr in frames):
-                if frames:
-                    frames[-1]['child'] = True
-                i += 1
+        if stripped[0] == '|':
+            pass
+        elif stripped.startswith('--'):
+            # child node without percentage like "   -- func" => treat as frame with 100%
+            if stripped.startswith('-- ') or line.lstrip().startswith('-- '):
+                func_name = sys.intern(line.lstrip()[3:].strip())
+                if func_name in names_on_stack:
+                    frame_has_child[-1] = 1
+                    continue
+                push_frame(func_name, 100.0)
                 continue
-            if frames:
-                frames[-1]['child'] = True
-            frames.append({'name': func_name, 'pct': None, 'child': False})
-            i += 1
+        elif not ('%' in stripped and _HAS_PCT_RE.search(stripped)):
+            # implicit child frame without markers: treat as a child of previous level (100% weight)
+            push_frame(sys.intern(stripped), 100.0)
             continue
 
-        m = re.search(r'\|--(\d+\.\d+%)--\s*(.+)', line)
+        m = _PIPE_FRAME_RE.search(line) if '|--' in line else None
         if m:
-            pct_str = m.group(1)
-            func_name = m.group(2).strip()
-            try:
-                pct_val = float(pct_str.rstrip('%'))
-            except Exception:
-                pct_val = 0.0
+            pct_val = float(m.group(1))
+            func_name = sys.intern(m.group(2).strip())
 
-            pipe_count = 0
-            for ch in line:
-                if ch == '|':
-                    pipe_count += 1
-                elif ch not in (' ', '\t'):
-                    break
-            rel_depth = max(0, pipe_count - 1)
+            # pipes in the indentation before the matched '|--' (the match's own '|' is the +1)
+            rel_depth = line.count('|', 0, m.start())
             if pipe_base_depth is None:
-                pipe_base_depth = len(frames)
+                pipe_base_depth = len(frame_names)
             depth = pipe_base_depth + rel_depth
 
-            while len(frames) > depth:
-                last = frames.pop()
-                if not last.get('child'):
-                    emit_leaf(frames + [last])
-            while len(context_stack) > depth:
-                context_stack.pop()
-
-            if pending_context:
-                while len(context_stack) < depth:
-                    context_stack.append([])
-                if len(context_stack) == depth:
-                    context_stack.append(pending_context[:])
-                else:
-                    context_stack[depth].extend(pending_context)
-                pending_context.clear()
+            while len(frame_names) > depth:
+                pop_frame()
 
-            if any(fr['name'] == func_name for fr in frames):
-                if frames:
-                    frames[-1]['child'] = True
-                i += 1
+            if func_name in names_on_stack:
+                frame_has_child[-1] = 1
                 continue
 
-            if frames:
-                frames[-1]['child'] = True
-            frames.append({'name': func_name, 'pct': pct_val, 'child': False})
-
-            if len(frames) > 512:
-                emit_leaf(frames)
-                break
-
-        i += 1
+            push_frame(func_name, pct_val)
 
-    if pending_context:
-        depth = len(frames)
-        while len(context_stack) < depth:
-            context_stack.append([])
-        if len(context_stack) == depth:
-            context_stack.append(pending_context[:])
-        else:
-            context_stack[depth].extend(pending_context)
-        pending_context.clear()
+            if len(frame_names) > 512:
+                emit_leaf()
+                truncated = True
 
-    while frames:
-        last = frames.pop()
-        if not last.get('child'):
-            emit_leaf(frames + [last])
+    while frame_names:
+        pop_frame()
 
     return stacks
 
 
-def skip_to_next_tree_or_main_entry(lines, start_idx):
-    i = start_idx + 1
-    while i < len(lines):
-        line = lines[i]
-        if not line.strip():
-            i += 1
-            continue
+def skip_to_next_tree_or_main_entry(reader):
+    for line in reader.stream():
         # next table entry or next root at column 0
-        if re.match(r'^\d+\.\d+%', line) or line.startswith('-- '):
-            return i
-        i += 1
-    return i
+        if (line[:1].isdigit() and _PCT_RE.match(line)) or line.startswith('-- '):
+            reader.push_back(line)
+            return
 
 
-def skip_to_next_main_entry(lines, start_idx):
-    i = start_idx
-    while i < len(lines):
-        line = lines[i]
-        if re.match(r'^\d+\.\d+%', line):
-            return i
-        i += 1
-    return i
+def skip_to_next_main_entry(reader):
+    for line in reader.stream():
+        if line[:1].isdigit() and _PCT_RE.match(line):
+            reader.push_back(line)
+            return
 
 
 def validate_folded_file(folded_path):
@@ -499,13 +611,9 @@ def validate_folded_file(folded_path):
                 if not line:
                     continue
                 parts = line.rsplit(' ', 1)
-                if len(parts) == 2:
-                    try:
-                        count = int(parts[1])
-                        if count > 0:
-                            valid_lines += 1
-                    except ValueError:
-                        pass
+                # valid when the count is a positive integer (digits, not all zeros)
+                if len(parts) == 2 and parts[1].isdecimal() and parts[1].lstrip('0'):
+                    valid_lines += 1
                 if line_num >= 1000:
                     break
         if valid_lines == 0:
@@ -518,31 +626,113 @@ def validate_folded_file(folded_path):
         return False, f"Error reading file: {e}"
 
 
+def _write_batched(f, lines, batch_size=10000):
+    """Write text lines to f in joined batches rather than one write call per line."""
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= batch_size:
+            f.write(''.join(batch))
+            batch.clear()
+    if batch:
+        f.write(''.join(batch))
+
+
+class _FoldedWriter:
+    """Folded-file sink for parse_report_text(on_stack=...) that never holds the whole stack set.
+
+    Counts are merged in a bounded dict and written out whenever it reaches max_entries. A stack
+    that shows up again after a flush gets a second line; flamegraph.pl sums duplicate lines.
+    Lines go to a temporary file next to out_path that replaces it only on a clean exit, so a
+    failed parse (including sys.exit) leaves any existing out_path untouched.
+    """
+
+    def __init__(self, out_path, max_entries=1000000):
+        self.out_path = out_path
+        self._tmp_path = out_path + '.tmp'
+        self._f = open(self._tmp_path, 'w', encoding='utf-8', buffering=_WRITE_BUFFER)
+        self._pending = defaultdict(float)
+        self.max_entries = max_entries
+        self.lines_written = 0
+
+    def add(self, stack, count):
+        self._pending[stack] += count
+        if len(self._pending) >= self.max_entries:
+            self.flush()
+
+    def flush(self):
+        def folded_lines():
+            for stack, count in self._pending.items():
+                c = int(round(count))
+                if c <= 0:
+                    continue
+                self.lines_written += 1
+                yield f"{stack} {c}\n"
+
+        _write_batched(self._f, folded_lines())
+        self._pending.clear()
+
+    def close(self):
+        self.flush()
+        self._f.close()
+        os.replace(self._tmp_path, self.out_path)
+
+    def discard(self):
+        self._f.close()
+        _remove_file(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
 def write_folded(stacks, out_path):
-    with open(out_path, 'w', encoding='utf-8') as f:
+    def folded_lines():
         for stack, count in stacks.items():
-            try:
-                c = int(count)
-            except Exception:
+            # parse_report_text already rounds its counts to int; only convert other values
+            if type(count) is int:
+                c = count
+            else:
                 try:
-                    c = int(round(float(count)))
+                    c = int(count)
                 except Exception:
-                    c = 0
+                    try:
+                        c = int(round(float(count)))
+                    except Exception:
+                        c = 0
             if c <= 0:
                 continue
-            f.write(f"{stack} {c}\n")
+            yield f"{stack} {c}\n"
+
+    with open(out_path, 'w', encoding='utf-8', buffering=_WRITE_BUFFER) as f:
+        _write_batched(f, folded_lines())
 
 
 def write_folded_ordered_for_flamegraph(stacks, out_path, total_event_count):
     # Write counts as parsed, without any scaling/normalization. Skip zero or negative counts.
     written = 0
-    with open(out_path, 'w', encoding='utf-8') as f:
+
+    def folded_lines():
+        nonlocal written
         for stack, count in stacks.items():
-            c = int(round(count)) if isinstance(count, (int, float)) else int(count)
+            if type(count) is int:
+                c = count
+            elif isinstance(count, float):
+                c = int(round(count))
+            else:
+                c = int(count)
             if c <= 0:
                 continue
-            f.write(f"{stack} {c}\n")
             written += c
+            yield f"{stack} {c}\n"
+
+    with open(out_path, 'w', encoding='utf-8', buffering=_WRITE_BUFFER) as f:
+        _write_batched(f, folded_lines())
     return written
 
 
@@ -668,6 +858,14 @@ def call_flamegraph(flamegraph_path, folded_path, svg_out, perl_path=None, basic
     return html_out
 
 
+def _download_and_call_flamegraph(flamegraph_path, folded_path, svg_out, **kwargs):
+    # Runs on the SVG worker thread, so a failed download surfaces at svg_future.result(),
+    # after the explain output and the HTML have been produced
+    if not flamegraph_path:
+        flamegraph_path = download_flamegraph()
+    return call_flamegraph(flamegraph_path, folded_path, svg_out, **kwargs)
+
+
 def create_responsive_flamegraph_html(svg_path, html_out, basic_info=None, event_count=None, total_samples=None, events_per_sample=None):
     if not os.path.isfile(svg_path):
         raise FileNotFoundError(f"SVG file not found: {svg_path}")
@@ -762,49 +960,152 @@ function toggleFullscreen() {
         f.write(html_content)
 
 
-def stacks_to_tree(stacks, event_count):
-    root = {'name': 'root', 'count': 0, 'children': {}}
-    for stack, cnt in stacks.items():
-        parts = stack.split(';')
-        node = root
-        for p in parts:
-            children = node['children']
-            if p not in children:
-                children[p] = {'name': p, 'count': 0, 'children': {}}
-            node = children[p]
-            node['count'] += cnt
-    root['count'] = sum(child['count'] for child in root['children'].values())
-
-    insertion_order = {}
-    order_counter = 0
-
-    def record_order(stacks_dict, node_dict):
-        nonlocal order_counter
-        for stack in stacks_dict.keys():
+class _StackTree:
+    """Call tree of folded stacks kept as flat arrays instead of nested dicts.
+
+    Node i is names[i] / counts[i] / children[i] (child ids in display order); node 0 is the
+    root. Nested dicts for JSON are only built on demand, one subtree at a time, by to_dict().
+    """
+
+    def __init__(self, stacks):
+        # Frame names are interned to small ints in first-seen order (which is also the sibling
+        # tie-break order), and the child lookup is keyed by the packed int (parent_id << 32) | frame_id.
+        names = ['root']
+        counts = array('q', [0])
+        frame_ids = array('l', [-1])
+        children = [[]]
+        node_ids = {}
+        insertion_order = {}
+        frame_names = []  # one shared str per distinct frame, reused by every node naming it
+        total = 0
+        max_depth = 0
+        for stack, cnt in stacks.items():
+            total += cnt
+            parent = 0
             parts = stack.split(';')
-            current = node_dict
-            for part in parts:
-                if part in current['children']:
-                    if part not in insertion_order:
-                        insertion_order[part] = order_counter
-                        order_counter += 1
-                    current = current['children'][part]
-
-    record_order(stacks, root)
+            if len(parts) > max_depth:
+                max_depth = len(parts)
+            for p in parts:
+                fid = insertion_order.get(p)
+                if fid is None:
+                    fid = insertion_order[p] = len(frame_names)
+                    frame_names.append(sys.intern(p))
+                key = (parent << 32) | fid
+                cid = node_ids.get(key)
+                if cid is None:
+                    cid = len(names)
+                    names.append(frame_names[fid])
+                    counts.append(0)
+                    frame_ids.append(fid)
+                    children.append([])
+                    node_ids[key] = cid
+                    children[parent].append(cid)
+                counts[cid] += cnt
+                parent = cid
+        counts[0] = total
+
+        # Siblings sort by count descending, then first-seen frame order. Counts are
+        # non-negative and frame ids fit in 32 bits, so both fold into one int key per node.
+        sort_keys = [fid - (cnt << 32) for cnt, fid in zip(counts, frame_ids)]
+        for kids in children:
+            if len(kids) > 1:
+                kids.sort(key=sort_keys.__getitem__)
+
+        self.names = names
+        self.counts = counts
+        self.children = children
+        self.max_depth = max_depth  # levels below the root; brief-mode stacks have no frame cap
+
+    def node_dict(self, i):
+        """Node i as a dict with an empty children list."""
+        # Share of the root count, preformatted so the HTML viewer does not compute it per node
+        pct = f"{self.counts[i] / (self.counts[0] or 1) * 100:.2f}" if i else '100.00'
+        return {'name': self.names[i], 'count': self.counts[i], 'pct': pct, 'children': []}
+
+    def to_dict(self, i=0):
+        """Subtree rooted at node i as nested dicts."""
+        # Built depth-first in display order (explicit stack, no recursion), so the subtree's
+        # dicts are allocated together in the order the JSON encoder visits them
+        names, counts, children = self.names, self.counts, self.children
+        root_count = counts[0] or 1
+        top = self.node_dict(i)
+        pending = [(i, top)]
+        while pending:
+            i, node = pending.pop()
+            kids = children[i]
+            if not kids:
+                continue
+            out = node['children']
+            for c in kids:
+                out.append({'name': names[c], 'count': counts[c], 'pct': f"{counts[c] / root_count * 100:.2f}", 'children': []})
+            pending.extend(zip(reversed(kids), reversed(out)))
+        return top
+
+    def heights(self):
+        """Height of every node's subtree (0 for a leaf), indexed like names / counts."""
+        # Children are always created after their parent, so a reverse sweep sees them first
+        children = self.children
+        heights = array('l', bytes(array('l').itemsize * len(children)))
+        for i in range(len(children) - 1, -1, -1):
+            kids = children[i]
+            if kids:
+                heights[i] = max(heights[c] for c in kids) + 1
+        return heights
 
-    def clean_and_convert(node):
-        result = {'name': node['name'], 'count': node['count'], 'children': []}
-        children_list = [clean_and_convert(child) for child in node['children'].values()]
-        children_list.sort(key=lambda x: (-x['count'], insertion_order.get(x['name'], 999999)))
-        result['children'] = children_list
-        return result
 
-    return clean_and_convert(root)
+def stacks_to_tree(stacks, event_count):
+    return _StackTree(stacks)
+
+
+# Deepest subtree (in tree levels) handed to a JSON encoder in one call. Every level nests an
+# object and a children list, and the encoders recurse per nesting level: orjson stops at 255
+# levels and the stdlib C encoder at the recursion limit, so deeper parts are written iteratively.
+_JSON_MAX_DEPTH = 100
+
+
+def _encode_json(obj):
+    if msgspec is not None:
+        return msgspec.json.encode(obj)
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), check_circular=False).encode('utf-8')
+
+
+def _write_json_tree(f, tree):
+    """Write a _StackTree as JSON one subtree at a time, building and encoding each subtree's
+    dicts in turn, so neither the whole document nor the whole nested dict tree exists at once.
+
+    Subtrees up to _JSON_MAX_DEPTH levels deep are encoded in one call; the levels above them
+    (only present in deep brief-mode trees) are opened and closed here with an explicit stack.
+    """
+    def open_node(i):
+        fields = tree.node_dict(i)
+        del fields['children']
+        return _encode_json(fields)[:-1] + b',"children":['
+
+    heights = tree.heights() if tree.max_depth > _JSON_MAX_DEPTH else None
+    f.write(open_node(0))
+    pending = [iter(tree.children[0])]
+    first = True
+    while pending:
+        child = next(pending[-1], None)
+        if child is None:
+            pending.pop()
+            f.write(b']}')
+            first = False
+            continue
+        if not first:
+            f.write(b',')
+        if heights is None or heights[child] < _JSON_MAX_DEPTH:
+            f.write(_encode_json(tree.to_dict(child)))
+            first = False
+        else:
+            f.write(open_node(child))
+            pending.append(iter(tree.children[child]))
+            first = True
 
 
-def write_html(tree, out_path, title='Stack Tree', event_count=None, total_samples=None, events_per_sample=None, basic_info=None):
-    data_json = json.dumps(tree, ensure_ascii=True)
-    html = """<!doctype html>
+_HTML_TEMPLATE = """<!doctype html>
 <html>
 <head>
 <meta charset="utf-8">
@@ -836,81 +1137,82 @@ li > span { cursor: pointer; user-select: none; }
 <div id="tree"></div>
 <script>
 const data = DATA_PLACEHOLDER;
-function createNode(node) {
-  const li = document.createElement('li');
-  const label = document.createElement('span');
-  if (node.children && node.children.length) {
-    const toggle = document.createElement('span');
-    toggle.textContent = '▼ ';
-    toggle.className = 'toggle';
-    label.appendChild(toggle);
-  }
-  const nameSpan = document.createElement('span');
-  nameSpan.textContent = node.name + (node.name !== 'root' ? '' : '');
-  label.appendChild(nameSpan);
-  const cnt = document.createElement('span');
-  if (node.name === 'root') {
-    cnt.textContent = ' (' + node.count + ', 100.00%)';
-  } else {
-    const percentage = ((node.count / data.count) * 100).toFixed(2);
-    cnt.textContent = ' (' + node.count + ', ' + percentage + '%)';
-  }
-  cnt.className = 'count';
-  label.appendChild(cnt);
-  li.appendChild(label);
-  if (node.children && node.children.length) {
-    const ul = document.createElement('ul');
-    ul.style.display = 'block';
-    for (const c of node.children) {
-      ul.appendChild(createNode(c));
-    }
-    li.appendChild(ul);
-    label.onclick = function(e) {
-      const toggle = label.querySelector('.toggle');
-      if (ul.style.display === 'none') {
-        ul.style.display = 'block';
-        toggle.textContent = '▼ ';
-      } else {
-        ul.style.display = 'none';
-        toggle.textContent = '▶ ';
-      }
-      e.stopPropagation();
-    };
+function escapeHtml(s) {
+  return s.replace(/[&<>"]/g, c => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;'})[c]);
+}
+// Subtrees are rendered on first expand; nodes[i] is the data node behind <li data-id="i">
+const nodes = [];
+function nodeHtml(node, depth) {
+  const id = nodes.push(node) - 1;
+  const hasChildren = node.children && node.children.length;
+  const expanded = hasChildren && depth > 0;
+  let html = '<li data-id="' + id + '"><span>' +
+    (hasChildren ? '<span class="toggle">' + (expanded ? '▼ ' : '▶ ') + '</span>' : '') +
+    '<span>' + escapeHtml(node.name) + '</span>' +
+    '<span class="count"> (' + node.count + ', ' + node.pct + '%)</span></span>';
+  if (expanded) {
+    html += childrenHtml(node, depth - 1);
   }
-  return li;
+  return html + '</li>';
+}
+function childrenHtml(node, depth) {
+  return '<ul style="display: block">' + node.children.map(c => nodeHtml(c, depth)).join('') + '</ul>';
 }
-function expandAll() { document.querySelectorAll('#tree ul').forEach(ul => { ul.style.display = 'block'; }); document.querySelectorAll('.toggle').forEach(toggle => { toggle.textContent = '▼ '; }); }
+function render(depth) {
+  nodes.length = 0;
+  document.getElementById('tree').innerHTML = '<ul>' + nodeHtml(data, depth) + '</ul>';
+}
+function expandAll() { render(Infinity); }
 function collapseAll() { document.querySelectorAll('#tree ul').forEach(ul => { ul.style.display = 'none'; }); document.querySelectorAll('.toggle').forEach(toggle => { toggle.textContent = '▶ '; }); }
-(function(){ const root = createNode(data); const container = document.getElementById('tree'); const ul = document.createElement('ul'); ul.appendChild(root); container.appendChild(ul); })();
+(function(){
+  render(1);
+  document.getElementById('tree').addEventListener('click', function(e) {
+    const label = e.target.closest('li > span');
+    const toggle = label && label.querySelector('.toggle');
+    if (!toggle) return;
+    const ul = label.nextElementSibling;
+    if (!ul) {
+      label.insertAdjacentHTML('afterend', childrenHtml(nodes[label.parentNode.dataset.id], 0));
+      toggle.textContent = '▼ ';
+    } else if (ul.style.display === 'none') {
+      ul.style.display = 'block';
+      toggle.textContent = '▼ ';
+    } else {
+      ul.style.display = 'none';
+      toggle.textContent = '▶ ';
+    }
+    e.stopPropagation();
+  });
+})();
 </script>
 </body>
 </html>
 """
-    html = html.replace('TITLE_PLACEHOLDER', title).replace('DATA_PLACEHOLDER', data_json)
-    if basic_info:
-        html = html.replace('CMDLINE_PLACEHOLDER', basic_info.get('cmdline', 'N/A'))
-        html = html.replace('ARCH_PLACEHOLDER', basic_info.get('arch', 'N/A'))
-        html = html.replace('EVENT_PLACEHOLDER', basic_info.get('event', 'N/A'))
-        html = html.replace('ERROR_CALLCHAINS_PLACEHOLDER', basic_info.get('error_callchains', 'N/A'))
-    else:
-        html = html.replace('CMDLINE_PLACEHOLDER', 'N/A')
-        html = html.replace('ARCH_PLACEHOLDER', 'N/A')
-        html = html.replace('EVENT_PLACEHOLDER', 'N/A')
-        html = html.replace('ERROR_CALLCHAINS_PLACEHOLDER', 'N/A')
-    if event_count is not None:
-        html = html.replace('EVENT_COUNT_PLACEHOLDER', f"{event_count:,}")
-    else:
-        html = html.replace('EVENT_COUNT_PLACEHOLDER', "N/A")
-    if total_samples is not None:
-        html = html.replace('TOTAL_SAMPLES_PLACEHOLDER', f"{total_samples:,}")
-    else:
-        html = html.replace('TOTAL_SAMPLES_PLACEHOLDER', "N/A")
-    if events_per_sample is not None:
-        html = html.replace('EVENTS_PER_SAMPLE_PLACEHOLDER', f"{events_per_sample:.2f}")
-    else:
-        html = html.replace('EVENTS_PER_SAMPLE_PLACEHOLDER', "N/A")
-    with open(out_path, 'w', encoding='utf-8') as f:
-        f.write(html)
+# Template split once at import into encoded literal segments and the placeholder after each
+_HTML_PARTS = re.split(r'([A-Z_]+)_PLACEHOLDER', _HTML_TEMPLATE)
+_HTML_SEGMENTS = tuple(part.encode('utf-8') for part in _HTML_PARTS[0::2])
+_HTML_PLACEHOLDERS = tuple(_HTML_PARTS[1::2]) + (None,)
+
+
+def write_html(tree, out_path, title='Stack Tree', event_count=None, total_samples=None, events_per_sample=None, basic_info=None):
+    info = basic_info or {}
+    values = {
+        'TITLE': title,
+        'CMDLINE': info.get('cmdline', 'N/A'),
+        'ARCH': info.get('arch', 'N/A'),
+        'EVENT': info.get('event', 'N/A'),
+        'ERROR_CALLCHAINS': info.get('error_callchains', 'N/A'),
+        'EVENT_COUNT': f"{event_count:,}" if event_count is not None else "N/A",
+        'TOTAL_SAMPLES': f"{total_samples:,}" if total_samples is not None else "N/A",
+        'EVENTS_PER_SAMPLE': f"{events_per_sample:.2f}" if events_per_sample is not None else "N/A",
+    }
+    with open(out_path, 'wb', buffering=_WRITE_BUFFER) as f:
+        for segment, placeholder in zip(_HTML_SEGMENTS, _HTML_PLACEHOLDERS):
+            f.write(segment)
+            if placeholder == 'DATA':
+                _write_json_tree(f, tree)
+            elif placeholder:
+                f.write(values[placeholder].encode('utf-8'))
 
 
 def main():
@@ -919,8 +1221,11 @@ def main():
     group.add_argument('--report', help='simpleperf text report file produced by: simpleperf report -g > report.txt')
     group.add_argument('--data', help='raw simpleperf data file (perf.data). The script will run simpleperf report -g on it')
     parser.add_argument('--folded', help='output folded stacks file (default: <report_or_data_basename>.folded)')
-    parser.add_argument('--svg', help='optional output svg path (default: <report_or_data_basename>.svg)')
-    parser.add_argument('--html', help='optional output interactive HTML tree (default: <report_or_data_basename>.html)')
+    parser.add_argument('--svg', nargs='?', const=True,
+                        help='output svg path; bare --svg uses <report_or_data_basename>.svg '
+                             '(default: only when flamegraph.pl is available locally via --flamegraph or ./flamegraph.pl)')
+    parser.add_argument('--html', nargs='?', const=True,
+                        help='output interactive HTML tree; bare --html uses <report_or_data_basename>.html (default: off)')
     parser.add_argument('--flamegraph', help='path to flamegraph.pl script')
     parser.add_argument('--perl', help='path to perl interpreter (optional)')
     parser.add_argument('--reverse', action='store_true', help='reverse frame order when building stacks')
@@ -929,85 +1234,95 @@ def main():
                         help='Only keep the first contiguous block per thread that starts with __start_thread; skip others')
     parser.add_argument('--equalize-root-sum', action='store_true',
                         help='Rescale each __start_thread tree so its leaf sum equals EventCount * Children% for that row')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='worker processes for parsing callgraph trees (default: 1, parse in-process)')
     args = parser.parse_args()
 
-    # If using --report, derive default output paths from its basename
-    if args.report:
-        base_dir = os.path.dirname(args.report)
-        base_name = os.path.splitext(os.path.basename(args.report))[0]
-        if not args.folded:
-            args.folded = os.path.join(base_dir, f"{base_name}.folded")
-        if args.svg is None:
-            args.svg = os.path.join(base_dir, f"{base_name}.svg")
-        if args.html is None:
-            args.html = os.path.join(base_dir, f"{base_name}.html")
-    # If using --data (no --report), derive defaults from data basename
-    elif args.data:
-        base_dir = os.path.dirname(args.data)
-        base_name = os.path.splitext(os.path.basename(args.data))[0]
-        if not args.folded:
-            args.folded = os.path.join(base_dir, f"{base_name}.folded")
-        if args.svg is None:
-            args.svg = os.path.join(base_dir, f"{base_name}.svg")
-        if args.html is None:
-            args.html = os.path.join(base_dir, f"{base_name}.html")
+    # Derive default output paths from the --report / --data basename
+    base_dir = os.path.dirname(args.report or args.data)
+    base_name = os.path.splitext(os.path.basename(args.report or args.data))[0]
+    if not args.folded:
+        args.folded = os.path.join(base_dir, f"{base_name}.folded")
+    # SVG is on by default only if it needs no download; HTML only when asked for
+    if args.svg is None and (args.flamegraph or os.path.isfile(os.path.join(os.getcwd(), 'flamegraph.pl'))):
+        args.svg = True
+    if args.svg is True:
+        args.svg = os.path.join(base_dir, f"{base_name}.svg")
+    if args.html is True:
+        args.html = os.path.join(base_dir, f"{base_name}.html")
 
     if args.data:
-        report_text = run_simpleperf_report(args.data)
-        if report_text is None:
+        report_path = run_simpleperf_report(args.data)
+        if report_path is None:
             sys.exit(1)
     else:
-        if not os.path.isfile(args.report):
+        report_path = args.report
+        if not os.path.isfile(report_path):
             sys.exit(1)
-        report_text = read_text_file_auto(args.report)
 
-    stacks, event_count, total_samples, basic_info, raw_stacks = parse_report_text(report_text, reverse=args.reverse, dedug_first_start=args.dedug_first_start, equalize_root_sum=args.equalize_root_sum)
-    if not stacks:
-        sys.exit(1)
+    # Tree vs brief mode is decided by a streaming pass of its own, so the parse does not have to
+    # buffer a brief-mode report looking for a tree line that never comes
+    parse_kwargs = dict(reverse=args.reverse, dedug_first_start=args.dedug_first_start, equalize_root_sum=args.equalize_root_sum,
+                        jobs=args.jobs, has_tree=report_has_tree(iter_report_lines(report_path)))
+    if args.html or args.explain_thread:
+        stacks, event_count, total_samples, basic_info, raw_stacks = parse_report_text(iter_report_lines(report_path), **parse_kwargs)
+        if not stacks:
+            sys.exit(1)
+        write_folded(stacks, args.folded)
+    else:
+        # Nothing else needs the full stack set: write the folded file while parsing
+        with _FoldedWriter(args.folded) as folded_writer:
+            stacks, event_count, total_samples, basic_info, raw_stacks = parse_report_text(iter_report_lines(report_path), on_stack=folded_writer.add, **parse_kwargs)
+        if not folded_writer.lines_written:
+            sys.exit(1)
 
     events_per_sample = event_count / total_samples if total_samples > 0 else 1
 
-    write_folded(stacks, args.folded)
     is_valid, _ = validate_folded_file(args.folded)
     if not is_valid:
         sys.exit(1)
 
-    # Explain mode: compare expected vs actual for "<Thread>;__start_thread"
-    if args.explain_thread:
-        thread = args.explain_thread
-        head_pct = find_thread_head_pct(report_text, thread)
-        expected_events = int(round((head_pct or 0.0) / 100.0 * event_count))
-        actual_events = sum(c for k, c in stacks.items() if k.startswith(f"{thread};__start_thread"))
-        folded_sum = sum(stacks.values())
-        # Print concise diagnostics
-        print(f"[Explain] Thread={thread}")
-        print(f"  Event count (total): {event_count}")
-        print(f"  First-row Children%: {head_pct if head_pct is not None else 'N/A'}%")
-        print(f"  Expected events (EventCount * Children%): {expected_events}")
-        print(f"  Actual folded events (keys starting with '{thread};__start_thread'): {actual_events}")
-        if event_count > 0:
-            print(f"  Actual as % of EventCount: {actual_events / event_count * 100:.2f}%")
-        if folded_sum > 0:
-            print(f"  Actual as % of FoldedSum: {actual_events / folded_sum * 100:.2f}% (FoldedSum={folded_sum})")
-
-    if args.html:
-        tree = stacks_to_tree(stacks, event_count)
-        write_html(tree, args.html, title=os.path.basename(args.folded),
-                   event_count=event_count, total_samples=total_samples,
-                   events_per_sample=events_per_sample, basic_info=basic_info)
-
-    if args.svg:
-        # Use the primary folded file directly for flamegraph to avoid duplicate .folded files
-        flamegraph_path = args.flamegraph
-        if not flamegraph_path:
-            flamegraph_path = download_flamegraph()
-        html_path = call_flamegraph(flamegraph_path, args.folded, args.svg, perl_path=args.perl,
-                                    basic_info=basic_info,
-                                    event_count=event_count,
-                                    total_samples=total_samples,
-                                    events_per_sample=events_per_sample)
-        if not os.path.isfile(html_path) or os.path.getsize(html_path) == 0:
-            sys.exit(1)
+    # flamegraph.pl runs as a separate process, so it overlaps with the explain pass and
+    # the HTML tree build below; only the folded file has to be complete before it starts
+    with ThreadPoolExecutor(max_workers=1) as svg_pool:
+        svg_future = None
+        if args.svg:
+            # Use the primary folded file directly for flamegraph to avoid duplicate .folded files
+            svg_future = svg_pool.submit(_download_and_call_flamegraph, args.flamegraph, args.folded, args.svg,
+                                         perl_path=args.perl,
+                                         basic_info=basic_info,
+                                         event_count=event_count,
+                                         total_samples=total_samples,
+                                         events_per_sample=events_per_sample)
+
+        # Explain mode: compare expected vs actual for "<Thread>;__start_thread"
+        if args.explain_thread:
+            thread = args.explain_thread
+            head_pct = find_thread_head_pct(iter_report_lines(report_path), thread)
+            expected_events = int(round((head_pct or 0.0) / 100.0 * event_count))
+            actual_events = sum(c for k, c in stacks.items() if k.startswith(f"{thread};__start_thread"))
+            folded_sum = sum(stacks.values())
+            # Print concise diagnostics
+            print(f"[Explain] Thread={thread}")
+            print(f"  Event count (total): {event_count}")
+            print(f"  First-row Children%: {head_pct if head_pct is not None else 'N/A'}%")
+            print(f"  Expected events (EventCount * Children%): {expected_events}")
+            print(f"  Actual folded events (keys starting with '{thread};__start_thread'): {actual_events}")
+            if event_count > 0:
+                print(f"  Actual as % of EventCount: {actual_events / event_count * 100:.2f}%")
+            if folded_sum > 0:
+                print(f"  Actual as % of FoldedSum: {actual_events / folded_sum * 100:.2f}% (FoldedSum={folded_sum})")
+
+        if args.html:
+            tree = stacks_to_tree(stacks, event_count)
+            write_html(tree, args.html, title=os.path.basename(args.folded),
+                       event_count=event_count, total_samples=total_samples,
+                       events_per_sample=events_per_sample, basic_info=basic_info)
+
+        if svg_future is not None:
+            html_path = svg_future.result()
+            if not os.path.isfile(html_path) or os.path.getsize(html_path) == 0:
+                sys.exit(1)
 
 
 if __name__ == '__main__':